@@ -1,200 +1,222 @@
 import pandas as pd # type: ignore
-import random
+import numpy as np
 import datetime
 from typing import List, Tuple
 import re
 
 class DataErrorGenerator:
-    def __init__(self, error_probability: float = 0.15, max_empty_percentage: float = 0.03):
+    def __init__(self, error_probability: float = 0.15, max_empty_percentage: float = 0.03, seed: int = None):
         self.error_prob = error_probability
         self.max_empty_percentage = max_empty_percentage
         self.station_variants = {}
         self.valid_start = datetime.datetime(2024, 1, 1, 0, 0, 0)
         self.valid_end = datetime.datetime(2024, 2, 1, 23, 59, 59)
         self.base_datetime_format = '%Y-%m-%d %H:%M:%S'
+        self.error_datetime_formats = [
+            '%Y/%m/%d %H:%M:%S',  # Standard with forward slashes
+            '%Y%m%d %H:%M:%S',    # No date separators
+            '%Y-%m-%d %H%M%S',    # No time separators
+            '%Y-%m-%d-%H-%M-%S',  # All hyphens
+        ]
         self.coordinate_variants = {}
+        self.rng = np.random.default_rng(seed)
+        self.rideable_type_variants = {
+            'classic_bike': ['class_bike', 'classic_bik', 'clasic_bike', 'classic bike'],
+            'electric_bike': ['electrc_bike', 'electric bike', 'eclectic_bike', 'elektric_bike']
+        }
+        self.member_type_variants = {
+            'member': ['Member', 'MEMBER', 'membr', 'Members'],
+            'casual': ['Casual', 'CASUAL', 'causual', 'Casuals']
+        }
         
-    def _generate_invalid_datetime(self) -> str:
-        if random.random() < 0.5:
-            # Generate date before valid start
-            invalid_dt = self.valid_start - datetime.timedelta(
-                days=random.randint(1, 365),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59),
-                seconds=random.randint(0, 59)
-            )
-        else:
-            # Generate date after valid end
-            invalid_dt = self.valid_end + datetime.timedelta(
-                days=random.randint(1, 365),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59),
-                seconds=random.randint(0, 59)
-            )
-        return invalid_dt.strftime(self.base_datetime_format)
-
-    def _format_datetime(self, dt_str: str) -> str:
-        try:
-            dt = datetime.datetime.strptime(dt_str, self.base_datetime_format)
-            formats = [
-                ('%Y/%m/%d %H:%M:%S', lambda x: x),  # Standard with forward slashes
-                ('%Y%m%d %H:%M:%S', lambda x: x),    # No date separators
-                ('%Y-%m-%d %H%M%S', lambda x: x.replace(':', '')),  # No time separators
-                ('%Y-%m-%d-%H-%M-%S', lambda x: x.replace(' ', '-').replace(':', '-')),  # All hyphens
-            ]
-            chosen_format, transformer = random.choice(formats)
-            return dt.strftime(chosen_format)
-        except (ValueError, TypeError):
-            return dt_str
+    def _format_datetimes(self, values: pd.Series, parsed: pd.Series, mask: np.ndarray) -> pd.Series:
+        # Pick a format per row, then render each format group in one call
+        chosen = self.rng.integers(0, len(self.error_datetime_formats), len(values))
+        mask = mask & parsed.notna().to_numpy()
+        for i, chosen_format in enumerate(self.error_datetime_formats):
+            group = mask & (chosen == i)
+            if group.any():
+                values.loc[group] = parsed.loc[group].dt.strftime(chosen_format)
+        return values
         
-    def _should_introduce_error(self) -> bool:
-        return random.random() < self.error_prob
+    def _error_mask(self, n: int) -> np.ndarray:
+        return self.rng.random(n) < self.error_prob
     
-    def _modify_ride_id(self, value: str) -> str:
-        if pd.isna(value):
-            return value
-            
-        if self._should_introduce_error():
-            # Add spaces randomly
-            value = ' '.join(value[i:i+2] for i in range(0, len(value), 2))
-        
-        if self._should_introduce_error():
-            # Modify capitalization
-            return ''.join(c.lower() if random.random() < 0.3 else c for c in value)
-            
-        return value
+    def _modify_ride_ids(self, values: pd.Series) -> pd.Series:
+        present = values.notna().to_numpy()
+
+        # Add spaces every two characters
+        space_mask = self._error_mask(len(values)) & present
+        if space_mask.any():
+            values.loc[space_mask] = values.loc[space_mask].str.replace(r'(..)', r'\1 ', regex=True).str.strip()
+
+        # Modify capitalization, lowering each character with probability 0.3
+        lower_mask = self._error_mask(len(values)) & present
+        if lower_mask.any():
+            ids = values.loc[lower_mask].to_numpy(dtype=str)
+            chars = ids.view('U1').reshape(len(ids), -1)
+            lowered = np.where(self.rng.random(chars.shape) < 0.3, np.char.lower(chars), chars)
+            values.loc[lower_mask] = lowered.view(ids.dtype).ravel().astype(object)
+
+        return values
     
-    def _modify_rideable_type(self, value: str) -> str:
-        if pd.isna(value):
-            return value
-            
-        if self._should_introduce_error():
-            errors = {
-                'classic_bike': ['class_bike', 'classic_bik', 'clasic_bike', 'classic bike'],
-                'electric_bike': ['electrc_bike', 'electric bike', 'eclectic_bike', 'elektric_bike']
-            }
-            for correct, variants in errors.items():
-                if correct in value:
-                    return random.choice(variants)
-        return value
+    def _with_categories(self, values: pd.Series, new_values) -> pd.Series:
+        # Categorical columns must know a value before it can be assigned
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            missing = pd.Index(new_values).unique().difference(values.cat.categories)
+            if len(missing) > 0:
+                values = values.cat.add_categories(missing)
+        return values
     
-    def _modify_datetime(self, start_dt: str, end_dt: str) -> Tuple[str, str]:
-        if pd.isna(start_dt) or pd.isna(end_dt):
-            return start_dt, end_dt
-            
-        try:
-            if self._should_introduce_error():
-                # Format change
-                start_dt = self._format_datetime(start_dt)
-                end_dt = self._format_datetime(end_dt)
-            
-            if self._should_introduce_error():
-                # Make end_dt before start_dt with larger time differences
-                dt = datetime.datetime.strptime(start_dt, self.base_datetime_format)
-                time_difference = random.choice([
-                    datetime.timedelta(hours=random.randint(1, 24)),  # Hours difference
-                    datetime.timedelta(days=random.randint(1, 7)),    # Days difference
-                    datetime.timedelta(weeks=random.randint(1, 4))    # Weeks difference
-                ])
-                end_dt = (dt - time_difference).strftime(self.base_datetime_format)
-                
-            return start_dt, end_dt
-        except (ValueError, TypeError):
-            return start_dt, end_dt
+    def _apply_variants(self, values: pd.Series, keys: pd.Series, variants: dict) -> pd.Series:
+        values = self._with_categories(values, [variant for choices in variants.values() for variant in choices])
+        mask = self._error_mask(len(values)) & values.notna().to_numpy()
+        for correct, choices in variants.items():
+            hit = mask & (keys == correct).fillna(False).to_numpy(dtype=bool)
+            if hit.any():
+                values.loc[hit] = self.rng.choice(choices, size=hit.sum())
+        return values
+
+    def _modify_rideable_types(self, values: pd.Series) -> pd.Series:
+        return self._apply_variants(values, values, self.rideable_type_variants)
 
-    def _get_station_variants(self, name: str, station_id: str, lat: float = None, lng: float = None) -> dict:
-        if pd.isna(name):
-            return {'names': [name], 'ids': [station_id], 'coordinates': [(lat, lng)]}
-            
-        if name not in self.station_variants:
-            # Generate 3-4 coordinate variants for this station
-            num_variants = random.randint(3, 4)
-            coordinate_variants = []
-            
-            # If we have initial coordinates, use them as base
-            if lat is not None and lng is not None and not (pd.isna(lat) or pd.isna(lng)):
-                base_lat, base_lng = lat, lng
-                # Generate coordinate variants
-                for _ in range(num_variants):
-                    lat_variation = random.uniform(-1, 1)
-                    lng_variation = random.uniform(-1, 1)
-                    coordinate_variants.append((base_lat + lat_variation, base_lng + lng_variation))
-            else:
-                coordinate_variants = [(lat, lng)]
-            
-            # Handle station_id carefully
-            try:
-                if pd.isna(station_id):
-                    id_variants = [station_id]
-                else:
-                    float_id = float(station_id) + 0.1
-                    int_id = int(station_id) + 1
-                    id_variants = [
-                        str(station_id),
-                        f"{str(float_id)}",
-                        f"{str(int_id)}"
-                    ]
-            except (ValueError, TypeError):
-                id_variants = [str(station_id)]
-            
-            self.station_variants[name] = {
-                'names': [
-                    name,
-                    name.title(),
-                    name.upper(),
-                    name.replace('&', 'and'),
-                    re.sub(r'\s+', '  ', name)
-                ],
-                'ids': id_variants,
-                'coordinates': coordinate_variants
-            }
-        return self.station_variants[name]
+    def _modify_member_types(self, values: pd.Series) -> pd.Series:
+        return self._apply_variants(values, values.str.lower(), self.member_type_variants)
     
-    def _modify_station_name(self, name: str, station_id: str) -> Tuple[str, str]:
-        if pd.isna(name) or pd.isna(station_id):
-            return name, station_id
+    def _modify_datetimes(self, start: pd.Series, end: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        n = len(start)
+        present = (start.notna() & end.notna()).to_numpy()
+
+        start_dt = pd.to_datetime(start, format=self.base_datetime_format, errors='coerce')
+        end_dt = pd.to_datetime(end, format=self.base_datetime_format, errors='coerce')
+
+        # Format change
+        format_mask = self._error_mask(n) & present
+        if format_mask.any():
+            start = self._format_datetimes(start, start_dt, format_mask)
+            end = self._format_datetimes(end, end_dt, format_mask)
+
+        # Make end before start with larger time differences; rows whose start
+        # was just reformatted are left alone
+        swap_mask = self._error_mask(n) & present & ~format_mask & start_dt.notna().to_numpy()
+        if swap_mask.any():
+            count = int(swap_mask.sum())
+            hours = np.choose(self.rng.integers(0, 3, count), [
+                self.rng.integers(1, 25, count),            # Hours difference
+                self.rng.integers(1, 8, count) * 24,        # Days difference
+                self.rng.integers(1, 5, count) * 24 * 7     # Weeks difference
+            ])
+            shifted = start_dt.loc[swap_mask] - pd.to_timedelta(hours, unit='h')
+            end.loc[swap_mask] = shifted.dt.strftime(self.base_datetime_format)
+
+        return start, end
+
+    def _create_station_variants(self, name: str, station_id: float, lat: float, lng: float) -> dict:
+        # Generate 3-4 coordinate variants for this station
+        num_variants = int(self.rng.integers(3, 5))
+        coordinate_variants = []
         
-        variants = self._get_station_variants(name, station_id)
+        # If we have initial coordinates, use them as base
+        if not (pd.isna(lat) or pd.isna(lng)):
+            base_lat, base_lng = lat, lng
+            # Generate coordinate variants
+            variations = self.rng.uniform(-1, 1, size=(num_variants, 2))
+            for lat_variation, lng_variation in variations:
+                coordinate_variants.append((base_lat + lat_variation, base_lng + lng_variation))
+        else:
+            coordinate_variants = [(lat, lng)]
         
-        modified_name = name
-        modified_id = str(station_id)
+        # Station id variants: the original, a 0.1 offset and the next integer
+        if pd.isna(station_id):
+            id_variants = [station_id]
+        else:
+            id_variants = [station_id, station_id + 0.1, station_id + 1]
         
-        if self._should_introduce_error():
-            modified_name = random.choice(variants['names'])
+        return {
+            'names': np.asarray([
+                name,
+                name.title(),
+                name.upper(),
+                name.replace('&', 'and'),
+                re.sub(r'\s+', '  ', name)
+            ], dtype=object),
+            'ids': np.asarray(id_variants, dtype=np.float64),
+            'coordinates': np.asarray(coordinate_variants, dtype=np.float64)
+        }
+
+    def _build_station_variants(self, df: pd.DataFrame) -> None:
+        station_columns = ['station_name', 'station_id', 'lat', 'lng']
+        stations = pd.concat([
+            df[['start_station_name', 'start_station_id', 'start_lat', 'start_lng']].set_axis(station_columns, axis=1),
+            df[['end_station_name', 'end_station_id', 'end_lat', 'end_lng']].set_axis(station_columns, axis=1)
+        ], ignore_index=True).dropna(subset=['station_name'])
         
-        if self._should_introduce_error():
-            modified_id = random.choice(variants['ids'])
-            
-        return modified_name, modified_id
-    
-    def _modify_coordinates(self, lat: float, lng: float, station_name: str, station_id: str) -> Tuple[float, float]:
-        if pd.isna(station_name) or pd.isna(lat) or pd.isna(lng):
-            return lat, lng
-            
-        if self._should_introduce_error():
-            # Get or create station variants including coordinates
-            variants = self._get_station_variants(station_name, station_id, lat, lng)
-            # Choose a random coordinate variant
-            return random.choice(variants['coordinates'])
-            
-        return lat, lng
-    
-    def _modify_member_type(self, value: str) -> str:
-        if pd.isna(value):
-            return value
-            
-        if self._should_introduce_error():
-            errors = {
-                'member': ['Member', 'MEMBER', 'membr', 'Members'],
-                'casual': ['Casual', 'CASUAL', 'causual', 'Casuals']
-            }
-            for correct, variants in errors.items():
-                if correct.lower() == value.lower():
-                    return random.choice(variants)
-        return value
+        # Prefer an occurrence with coordinates as the base for each station
+        has_coordinates = stations['lat'].notna() & stations['lng'].notna()
+        stations = pd.concat([stations[has_coordinates], stations[~has_coordinates]]).drop_duplicates('station_name')
+        
+        variants = [
+            self._create_station_variants(station.station_name, station.station_id, station.lat, station.lng)
+            for station in stations.itertuples(index=False)
+        ]
+        
+        # Stack every station's variants into padded tables indexed by station code;
+        # the counts record how many entries of each row are real
+        num_stations = len(variants)
+        ids = np.full((num_stations, 3), np.nan)
+        coordinates = np.full((num_stations, 4, 2), np.nan)
+        id_counts = np.empty(num_stations, dtype=np.int64)
+        coordinate_counts = np.empty(num_stations, dtype=np.int64)
+        for code, station_variants in enumerate(variants):
+            id_counts[code] = station_variants['ids'].size
+            ids[code, :id_counts[code]] = station_variants['ids']
+            coordinate_counts[code] = len(station_variants['coordinates'])
+            coordinates[code, :coordinate_counts[code]] = station_variants['coordinates']
+        
+        self.station_variants = {
+            'codes': pd.Index(stations['station_name']),
+            'names': np.stack([station_variants['names'] for station_variants in variants]) if variants else np.empty((0, 5), dtype=object),
+            'ids': ids,
+            'id_counts': id_counts,
+            'coordinates': coordinates,
+            'coordinate_counts': coordinate_counts
+        }
+
+    def _modify_stations(self, df: pd.DataFrame, prefix: str, flips: np.ndarray, draws: np.ndarray) -> None:
+        name_col, id_col = f'{prefix}_station_name', f'{prefix}_station_id'
+        lat_col, lng_col = f'{prefix}_lat', f'{prefix}_lng'
+        variants = self.station_variants
+        
+        # Station code per row, -1 where the name is missing
+        codes = variants['codes'].get_indexer(df[name_col].to_numpy(dtype=object))
+        known = codes >= 0
+        
+        # Modify station names and IDs where both are present
+        has_id = known & df[id_col].notna().to_numpy()
+        
+        name_mask = has_id & flips[:, 0]
+        if name_mask.any():
+            picks = (draws[name_mask, 0] * variants['names'].shape[1]).astype(np.int64)
+            new_names = variants['names'][codes[name_mask], picks]
+            df[name_col] = self._with_categories(df[name_col], new_names)
+            df.loc[name_mask, name_col] = new_names
+        
+        id_mask = has_id & flips[:, 1]
+        if id_mask.any():
+            picks = (draws[id_mask, 1] * variants['id_counts'][codes[id_mask]]).astype(np.int64)
+            df.loc[id_mask, id_col] = variants['ids'][codes[id_mask], picks]
+        
+        # Modify coordinates, looked up by the original station name
+        coordinate_mask = known & df[lat_col].notna().to_numpy() & df[lng_col].notna().to_numpy() & flips[:, 2]
+        if coordinate_mask.any():
+            picks = (draws[coordinate_mask, 2] * variants['coordinate_counts'][codes[coordinate_mask]]).astype(np.int64)
+            new_coordinates = variants['coordinates'][codes[coordinate_mask], picks]
+            df.loc[coordinate_mask, lat_col] = new_coordinates[:, 0]
+            df.loc[coordinate_mask, lng_col] = new_coordinates[:, 1]
     
-    def introduce_errors(self, df: pd.DataFrame) -> pd.DataFrame:
-        df_with_errors = df.copy()
+    def introduce_errors(self, df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+        # Mutating the caller's frame avoids holding two full copies in memory
+        df_with_errors = df if inplace else df.copy()
         # First, introduce empty values for each column
         for column in df.columns:
             if column != 'ride_id' and column != 'start_station_id' and column != 'end_station_id':  # Skip ride_id
@@ -203,92 +225,56 @@ class DataErrorGenerator:
                 num_empty = int(num_rows * self.max_empty_percentage)
                 
                 # Randomly select indices for empty values
-                empty_indices = random.sample(range(num_rows), num_empty)
+                empty_indices = df.index[self.rng.choice(num_rows, num_empty, replace=False)]
                 
                 # Set those indices to None
                 df_with_errors.loc[empty_indices, column] = None
 
-        # Ensure station ID columns are string type
+        # Keep station IDs numeric; float64 holds the decimal id variants and NaN
         id_columns = ['start_station_id', 'end_station_id']
         
         for col in id_columns:
-            # Convert to string but preserve NaN
-            df_with_errors[col] = df_with_errors[col].astype(str)
-            # df_with_errors.loc[df_with_errors[col] == 'nan', col] = None
+            df_with_errors[col] = pd.to_numeric(df_with_errors[col], errors='coerce').astype(np.float64)
         
-        for idx in df_with_errors.index:
-            # Modify ride_id
-            df_with_errors.at[idx, 'ride_id'] = self._modify_ride_id(df_with_errors.at[idx, 'ride_id'])
-            
-            # Modify rideable_type if present
-            if pd.notna(df_with_errors.at[idx, 'rideable_type']):
-                df_with_errors.at[idx, 'rideable_type'] = self._modify_rideable_type(df_with_errors.at[idx, 'rideable_type'])
-            
-            # Modify dates if both are present
-            if pd.notna(df_with_errors.at[idx, 'started_at']) and pd.notna(df_with_errors.at[idx, 'ended_at']):
-                start_dt, end_dt = self._modify_datetime(
-                    df_with_errors.at[idx, 'started_at'],
-                    df_with_errors.at[idx, 'ended_at']
-                )
-                df_with_errors.at[idx, 'started_at'] = start_dt
-                df_with_errors.at[idx, 'ended_at'] = end_dt
-            
-            # Modify station names and IDs if present
-            if pd.notna(df_with_errors.at[idx, 'start_station_name']):
-                name, station_id = self._modify_station_name(
-                    df_with_errors.at[idx, 'start_station_name'],
-                    df_with_errors.at[idx, 'start_station_id']
-                )
-                df_with_errors.at[idx, 'start_station_name'] = name
-                df_with_errors.at[idx, 'start_station_id'] = station_id
-            
-            if pd.notna(df_with_errors.at[idx, 'end_station_name']):
-                name, station_id = self._modify_station_name(
-                    df_with_errors.at[idx, 'end_station_name'],
-                    df_with_errors.at[idx, 'end_station_id']
-                )
-                df_with_errors.at[idx, 'end_station_name'] = name
-                df_with_errors.at[idx, 'end_station_id'] = station_id
-            
-            # Modify coordinates if present
-            if pd.notna(df_with_errors.at[idx, 'start_lat']):
-                lat, lng = self._modify_coordinates(
-                    df_with_errors.at[idx, 'start_lat'],
-                    df_with_errors.at[idx, 'start_lng'],
-                    df_with_errors.at[idx, 'start_station_name'],
-                    df_with_errors.at[idx, 'start_station_id']
-                )
-                df_with_errors.at[idx, 'start_lat'] = lat
-                df_with_errors.at[idx, 'start_lng'] = lng
-            
-            if pd.notna(df_with_errors.at[idx, 'end_lat']):
-                lat, lng = self._modify_coordinates(
-                    df_with_errors.at[idx, 'end_lat'],
-                    df_with_errors.at[idx, 'end_lng'],
-                    df_with_errors.at[idx, 'end_station_name'],
-                    df_with_errors.at[idx, 'end_station_id']
-                )
-                df_with_errors.at[idx, 'end_lat'] = lat
-                df_with_errors.at[idx, 'end_lng'] = lng
-            
-            # Modify member/casual status if present
-            if pd.notna(df_with_errors.at[idx, 'member_casual']):
-                df_with_errors.at[idx, 'member_casual'] = self._modify_member_type(df_with_errors.at[idx, 'member_casual'])
+        df_with_errors['ride_id'] = self._modify_ride_ids(df_with_errors['ride_id'])
+        df_with_errors['rideable_type'] = self._modify_rideable_types(df_with_errors['rideable_type'])
+        df_with_errors['started_at'], df_with_errors['ended_at'] = self._modify_datetimes(
+            df_with_errors['started_at'],
+            df_with_errors['ended_at']
+        )
+        df_with_errors['member_casual'] = self._modify_member_types(df_with_errors['member_casual'])
+
+        # Variants are computed once per unique station name
+        self._build_station_variants(df_with_errors)
+        
+        # One error decision and one variant draw per row for the name, id and
+        # coordinates of the start station, then the same for the end station
+        flip_mat = self.rng.random((len(df_with_errors), 6)) < self.error_prob
+        draw_mat = self.rng.random((len(df_with_errors), 6))
+        
+        self._modify_stations(df_with_errors, 'start', flip_mat[:, 0:3], draw_mat[:, 0:3])
+        self._modify_stations(df_with_errors, 'end', flip_mat[:, 3:6], draw_mat[:, 3:6])
         
         return df_with_errors
 
 def main():
     # Read the CSV file
-    df = pd.read_csv('clean_testfile.csv')
+    # Dates stay as text; the pyarrow engine would otherwise parse them into timestamps
+    df = pd.read_csv('clean_testfile.csv', engine='pyarrow', dtype={'started_at': str, 'ended_at': str})
+    
+    # Low-cardinality text columns are stored as categories
+    categorical_columns = ['rideable_type', 'member_casual', 'start_station_name', 'end_station_name']
+    df[categorical_columns] = df[categorical_columns].astype('category')
     
     # Create error generator with 15% probability for other errors
     # and 3% maximum empty values per column
     error_generator = DataErrorGenerator(error_probability=0.65, max_empty_percentage=0.03)
     
-    # Generate errors
-    df_with_errors = error_generator.introduce_errors(df)
+    # Generate errors; the clean frame is not needed afterwards
+    df_with_errors = error_generator.introduce_errors(df, inplace=True)
     
-    # Save the result
+    # Save the result; pyarrow's writer quotes every string field, so to_csv keeps the
+    # format the Phi-3 scripts were run against
     df_with_errors.to_csv('testfile.csv', index=False)
 
 if __name__ == "__main__":
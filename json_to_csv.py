@@ -1,33 +1,49 @@
+import orjson
 import json
-import csv
+import pandas as pd
 from typing import Dict, List
-from collections import OrderedDict
 
 
-def flatten_json(nested_json: Dict, parent_key: str = '', separator: str = '_') -> OrderedDict:
-    items: List = []
-    for key, value in nested_json.items():
-        new_key = f"{parent_key}{separator}{key}" if parent_key else key
-        
-        if isinstance(value, dict):
-            items.extend(flatten_json(value, new_key, separator).items())
-        elif isinstance(value, list):
-            if len(value) > 0:
-                if isinstance(value[0], dict):
-                    raise ValueError("Lists of dictionaries are not supported in flattening")
-                items.append((new_key, str(value)))
-        else:
-            items.append((new_key, value))
-    return OrderedDict(items)
+def flatten_json(nested_json: Dict, parent_key: str = '', separator: str = '_') -> Dict:
+    flattened: Dict = {}
+    # Walk nested dictionaries with an explicit stack of (prefix, dict) pairs
+    stack = [(parent_key, nested_json)]
+    while stack:
+        prefix, current = stack.pop()
+        for key, value in current.items():
+            new_key = f"{prefix}{separator}{key}" if prefix else key
+            
+            if isinstance(value, dict):
+                stack.append((new_key, value))
+            elif isinstance(value, list):
+                if len(value) > 0:
+                    if isinstance(value[0], dict):
+                        raise ValueError("Lists of dictionaries are not supported in flattening")
+                    flattened[new_key] = str(value)
+            else:
+                flattened[new_key] = value
+    return flattened
+
+def loads(text: bytes):
+    try:
+        return orjson.loads(text)
+    except json.JSONDecodeError:
+        # orjson rejects NaN/Infinity, which json.dump writes for missing values
+        return json.loads(text)
+
 
 def json_to_csv_with_order(json_file_path: str, csv_file_path: str, column_order: List[str]) -> None:
     try:
-        # Read JSON file with object_pairs_hook to maintain order
-        with open(json_file_path, 'r', encoding='utf-8') as json_file:
-            data = json.load(json_file, object_pairs_hook=OrderedDict)
+        # Read JSON file (dicts keep key order)
+        with open(json_file_path, 'rb') as json_file:
+            if json_file_path.endswith('.jsonl'):
+                # JSON lines: one object per non-empty line
+                data = [loads(line) for line in json_file if line.strip()]
+            else:
+                data = loads(json_file.read())
         
         # Handle both single dict and list of dicts
-        if isinstance(data, (dict, OrderedDict)):
+        if isinstance(data, dict):
             data = [data]
         elif not isinstance(data, list):
             raise ValueError("JSON must contain either a dictionary or a list of dictionaries")
@@ -45,17 +61,9 @@ def json_to_csv_with_order(json_file_path: str, csv_file_path: str, column_order
         if not flattened_data:
             raise ValueError("No valid data to write to CSV")
         
-        # Ensure all rows have all columns (fill missing values with empty strings)
-        for row in flattened_data:
-            for column in column_order:
-                if column not in row:
-                    row[column] = ""  # Fill missing columns with empty strings
-        
-        # Write to CSV using the specified column order
-        with open(csv_file_path, 'w', newline='', encoding='utf-8') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=column_order)
-            writer.writeheader()
-            writer.writerows(flattened_data)
+        # Write to CSV using the specified column order; missing columns are filled with empty strings
+        df = pd.DataFrame(flattened_data, dtype=object).reindex(columns=column_order, fill_value="")
+        df.to_csv(csv_file_path, index=False, encoding='utf-8')
             
         print(f"Successfully converted {json_file_path} to {csv_file_path} with specified column order")
         
@@ -67,7 +75,7 @@ def json_to_csv_with_order(json_file_path: str, csv_file_path: str, column_order
         print(f"Error: An unexpected error occurred: {str(e)}")
 
 # Specify your input, output files, and column order here
-input_file = "cleaned_data.json"
+input_file = "cleaned_data.jsonl"
 output_file = "cleaned_data.csv"
 desired_column_order = [
     "ride_id", "rideable_type", "started_at", "ended_at",
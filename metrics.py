@@ -1,49 +1,53 @@
 import pandas as pd
+import numpy as np
+
+EXPECTED_COLUMNS = [
+    "ride_id", "rideable_type", "started_at", "ended_at",
+    "start_station_name", "start_station_id", "end_station_name", "end_station_id", "start_lat", "start_lng", "end_lat", "end_lng", "member_casual"
+]
+# Read as plain strings with no type inference; ids and coordinates stay numeric so 31641 matches 31641.0
+TEXT_COLUMNS = ["ride_id", "rideable_type", "started_at", "ended_at", "start_station_name", "end_station_name", "member_casual"]
 
 def load_csv(file_path: str) -> pd.DataFrame:
-    return pd.read_csv(file_path)
+    df = pd.read_csv(file_path, engine='pyarrow', usecols=EXPECTED_COLUMNS, dtype={column: str for column in TEXT_COLUMNS})
+    return df[EXPECTED_COLUMNS]
 
 def calculate_metrics(clean_file: pd.DataFrame, cleaned_file: pd.DataFrame, error_file: pd.DataFrame) -> pd.DataFrame:
     if not all(clean_file.columns == cleaned_file.columns) or not all(clean_file.columns == error_file.columns):
         raise ValueError("Files have mismatched columns.")
 
-    metrics = []
-
-    total_correct_repairs = 0
-    total_repairs = 0
-    total_errors = 0
-
-    for column in clean_file.columns:
-        # Ground truth, cleaned output, and input with errors for the column
-        ground_truth = clean_file[column]
-        cleaned_output = cleaned_file[column]
-        input_with_errors = error_file[column]
+    # Ground truth, cleaned output, and input with errors as 2-D arrays
+    ground_truth = clean_file.to_numpy()
+    cleaned_output = cleaned_file.to_numpy()
+    input_with_errors = error_file.to_numpy()
 
-        # Calculate correct repairs
-        correct_repairs = (input_with_errors != ground_truth) & (cleaned_output == ground_truth)
-        repairs = (input_with_errors != cleaned_output)
-        errors = (input_with_errors != ground_truth)
+    # Calculate correct repairs for every column at once
+    errors_mask = input_with_errors != ground_truth
+    correct_repairs = (errors_mask & (cleaned_output == ground_truth)).sum(axis=0)
+    repairs = (input_with_errors != cleaned_output).sum(axis=0)
+    errors = errors_mask.sum(axis=0)
 
-        precision = correct_repairs.sum() / repairs.sum() if repairs.sum() > 0 else 0
-        recall = correct_repairs.sum() / errors.sum() if errors.sum() > 0 else 0
-        f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) > 0 else 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(repairs > 0, correct_repairs / repairs, 0)
+        recall = np.where(errors > 0, correct_repairs / errors, 0)
+        f1 = np.where((precision + recall) > 0, 2 * precision * recall / (precision + recall), 0)
 
-        total_correct_repairs += correct_repairs.sum()
-        total_repairs += repairs.sum()
-        total_errors += errors.sum()
+    metrics = pd.DataFrame({
+        "column": clean_file.columns,
+        "precision": precision,
+        "recall": recall,
+        "f1_score": f1
+    })
 
-        metrics.append({
-            "column": column,
-            "precision": precision,
-            "recall": recall,
-            "f1_score": f1
-        })
+    total_correct_repairs = correct_repairs.sum()
+    total_repairs = repairs.sum()
+    total_errors = errors.sum()
 
     overall_precision = total_correct_repairs / total_repairs if total_repairs > 0 else 0
     overall_recall = total_correct_repairs / total_errors if total_errors > 0 else 0
     overall_f1 = (2 * overall_precision * overall_recall / (overall_precision + overall_recall)) if (overall_precision + overall_recall) > 0 else 0
 
-    return pd.DataFrame(metrics), overall_precision, overall_recall, overall_f1
+    return metrics, overall_precision, overall_recall, overall_f1
 
 # File paths
 clean_file_path = "clean_testfile.csv"
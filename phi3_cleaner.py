@@ -0,0 +1,429 @@
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, DynamicCache
+from transformers.utils import is_bitsandbytes_available, is_flash_attn_2_available
+try:
+    from vllm import LLM, SamplingParams
+except ImportError:  # vLLM needs CUDA; transformers generate is used otherwise
+    LLM = None
+try:
+    from vllm.sampling_params import GuidedDecodingParams
+except ImportError:  # Not every vLLM release has it; output is then not schema-constrained
+    GuidedDecodingParams = None
+import pandas as pd
+import orjson
+import json
+from tqdm import tqdm
+import os
+import copy
+import hashlib
+import shelve
+from concurrent.futures import ThreadPoolExecutor
+
+
+BATCH_SIZE = 8
+SORT_WINDOW = 4 * BATCH_SIZE  # Rows whose prompts are sorted by length before batching
+EMPTY_CACHE_EVERY = 50  # Batches between releases of cached device memory
+FSYNC_EVERY = 500  # Rows between forcing the output file to disk
+MODEL_NAME = "microsoft/Phi-3-mini-4k-instruct"
+# Model responses keyed by a hash of the model, backend, decoding settings and prompt, kept across runs
+RESPONSE_CACHE_PATH = "phi3_response_cache"
+
+# Schema of a cleaned row; vLLM only lets the model emit JSON matching it
+CLEANED_ROW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ride_id": {"type": "string"},
+        "rideable_type": {"type": "string"},
+        "started_at": {"type": "string"},
+        "ended_at": {"type": "string"},
+        "start_station_name": {"type": "string"},
+        "start_station_id": {"type": "string"},
+        "end_station_name": {"type": "string"},
+        "end_station_id": {"type": "string"},
+        "start_lat": {"type": "number"},
+        "start_lng": {"type": "number"},
+        "end_lat": {"type": "number"},
+        "end_lng": {"type": "number"},
+        "member_casual": {"type": "string"}
+    },
+    "required": [
+        "ride_id", "rideable_type", "started_at", "ended_at",
+        "start_station_name", "start_station_id", "end_station_name", "end_station_id",
+        "start_lat", "start_lng", "end_lat", "end_lng", "member_casual"
+    ],
+    "additionalProperties": False
+}
+# transformers has no schema-constrained decoding here, so its responses are started
+# with the opening brace to skip any preamble or code fence
+RESPONSE_START = "{"
+
+def load_phi3_model():
+    torch.random.manual_seed(0)
+    
+    if torch.cuda.is_available():
+        device = torch.device("cuda")
+    elif torch.backends.mps.is_available():
+        device = torch.device("mps")
+    else:
+        device = torch.device("cpu")
+    print(f"Using device: {device}")
+    
+    # FlashAttention-2 on CUDA when flash-attn is installed, fused scaled-dot-product attention otherwise;
+    # both need the Phi3 class built into transformers, so the model is loaded without remote code
+    if device.type == "cuda" and is_flash_attn_2_available():
+        attn_implementation = "flash_attention_2"
+    else:
+        attn_implementation = "sdpa"
+    
+    # 4-bit NF4 weights on CUDA when bitsandbytes is installed
+    load_in_4bit = device.type == "cuda" and is_bitsandbytes_available()
+    
+    if load_in_4bit:
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_NAME,
+            # Quantized weights are placed on the GPU while loading; they cannot be moved with .to()
+            device_map={"": device},
+            quantization_config=BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16
+            ),
+            attn_implementation=attn_implementation
+        )
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_NAME, 
+            device_map=None,
+            # Half precision on GPUs; full precision on CPU so it can be quantized below
+            torch_dtype=torch.float32 if device.type == "cpu" else torch.float16,
+            attn_implementation=attn_implementation
+        ).to(device)
+    
+    if device.type == "cpu":
+        # Int8 weights for the linear layers cut memory traffic per decode step; quantize in
+        # place so the fp32 model is not copied
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    
+    model.eval()
+    
+    if device.type == "cuda":
+        # A pre-allocated KV cache gives every decode step the same shapes, so the
+        # compiled forward pass is captured once and replayed as a CUDA graph
+        model.generation_config.cache_implementation = "static"
+        # FlashAttention-2 and bitsandbytes kernels break the graph, so only SDPA over
+        # unquantized weights in the built-in Phi3 class is compiled as a single graph
+        model.forward = torch.compile(
+            model.forward,
+            mode="reduce-overhead",
+            fullgraph=attn_implementation == "sdpa" and not load_in_4bit
+        )
+    
+    tokenizer = AutoTokenizer.from_pretrained(
+        MODEL_NAME,
+        model_max_length=2048,
+        padding_side='left'
+    )
+    tokenizer.pad_token = tokenizer.eos_token
+    
+    return model, tokenizer, device
+
+def process_single_response(response_text, row, row_number):
+    try:
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}') + 1
+        
+        if json_start >= 0 and json_end > json_start:
+            json_text = response_text[json_start:json_end]
+            try:
+                try:
+                    corrected_row = orjson.loads(json_text)
+                except orjson.JSONDecodeError:
+                    # orjson rejects NaN/Infinity, which the model sometimes emits for missing values
+                    corrected_row = json.loads(json_text)
+
+                changes = {k: v for k, v in corrected_row.items() if str(v) != str(row[k])}
+                if changes:
+                    print(f"\nRow {row_number} changes:")
+                    for field, new_value in changes.items():
+                        print(f"  {field}: {row[field]} → {new_value}")
+                return corrected_row
+                    
+            except json.JSONDecodeError:
+                print(f"\nCouldn't parse JSON for row {row_number}")
+                return row
+                
+    except Exception as e:
+        print(f"\nError processing row {row_number}: {str(e)}")
+    
+    return row
+
+def build_messages(row, system_prompt, create_prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": create_prompt(row)}
+    ]
+
+def build_prompts(rows, tokenizer, system_prompt, create_prompt):
+    return [
+        tokenizer.apply_chat_template(
+            build_messages(row, system_prompt, create_prompt), tokenize=False, add_generation_prompt=True
+        )
+        for row in rows
+    ]
+
+def shared_prefix_ids(tokenizer, system_prompt):
+    # Render the system message with two different user messages; the tokens they
+    # have in common are the part of every prompt that does not depend on the row
+    encoded = tokenizer(
+        [
+            tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt}, {"role": "user", "content": content}],
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            for content in ("A", "B")
+        ],
+        add_special_tokens=False
+    )["input_ids"]
+    
+    length = 0
+    while encoded[0][length] == encoded[1][length]:
+        length += 1
+    return encoded[0][:length]
+
+def tokenize_after_prefix(prompts, model, tokenizer, device, prefix):
+    prefix_length = len(prefix["ids"])
+    # Each full prompt is tokenized; the shared prefix is then checked and dropped, since
+    # tokens at the prefix boundary could merge differently if only the row text were encoded
+    row_ids = []
+    for ids in tokenizer(prompts, truncation=True, max_length=1536, add_special_tokens=False)["input_ids"]:
+        if ids[:prefix_length] != prefix["ids"]:
+            return None
+        row_ids.append(ids[prefix_length:])
+    
+    # Left-pad only the row tokens, so padding sits between the shared prefix and each row
+    row_inputs = tokenizer.pad({"input_ids": row_ids}, padding=True, return_tensors="pt").to(device)
+    
+    # Prefill the prefix once for a single row; every batch expands it to its own size
+    if prefix["cache"] is None:
+        prefix["tensor"] = torch.tensor([prefix["ids"]], device=device)
+        with torch.inference_mode():
+            prefix["cache"] = model(
+                input_ids=prefix["tensor"],
+                past_key_values=DynamicCache(),
+                use_cache=True
+            ).past_key_values
+    prefix_ids = prefix["tensor"].expand(len(prompts), -1)
+    
+    # generate extends the cache in place, so each batch starts from a copy
+    past_key_values = copy.deepcopy(prefix["cache"])
+    past_key_values.batch_repeat_interleave(len(prompts))
+    
+    return {
+        "input_ids": torch.cat([prefix_ids, row_inputs["input_ids"]], dim=1),
+        "attention_mask": torch.cat([torch.ones_like(prefix_ids), row_inputs["attention_mask"]], dim=1),
+        "past_key_values": past_key_values
+    }
+
+def cache_namespace(backend, settings):
+    # The same prompt gives a different response under another model, backend or decoding settings
+    return hashlib.blake2b(f"{MODEL_NAME}|{backend}|{settings!r}".encode(), digest_size=16).hexdigest()
+
+def prompt_key(prompt, namespace):
+    return hashlib.blake2b(f"{namespace}|{prompt}".encode()).hexdigest()
+
+def generate_responses(prompts, model, tokenizer, device, generation_args, prefix=None):
+    prompts = [prompt + RESPONSE_START for prompt in prompts]
+    
+    inputs = None
+    if prefix is not None:
+        inputs = tokenize_after_prefix(prompts, model, tokenizer, device, prefix)
+    
+    if inputs is None:
+        # One left-padded tensor per batch; the chat template already adds the BOS token
+        inputs = tokenizer(
+            prompts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=1536,
+            pad_to_multiple_of=64,  # Few distinct prompt lengths, so few recompiles
+            add_special_tokens=False
+        ).to(device)
+    
+    with torch.inference_mode():
+        output_ids = model.generate(
+            **inputs,
+            pad_token_id=tokenizer.eos_token_id,
+            tokenizer=tokenizer,  # Needed to match stop_strings
+            **generation_args
+        )
+    
+    # Keep only the newly generated tokens
+    responses = tokenizer.batch_decode(output_ids[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+    return [RESPONSE_START + response for response in responses]
+
+def process_batch(rows, prompts, row_numbers, model, tokenizer, device, generation_args, response_cache, namespace, prefix=None):
+    # Decoding is greedy, so a prompt that was answered before gets the same response
+    keys = [prompt_key(prompt, namespace) for prompt in prompts]
+    pending = [i for i, key in enumerate(keys) if key not in response_cache]
+    
+    if pending:
+        try:
+            responses = generate_responses(
+                [prompts[i] for i in pending], model, tokenizer, device, generation_args, prefix
+            )
+        except Exception as e:
+            print(f"\nError processing rows {', '.join(map(str, row_numbers))}: {str(e)}")
+            return list(rows)
+        
+        for i, response in zip(pending, responses):
+            response_cache[keys[i]] = response
+    
+    return [
+        process_single_response(response_cache[key], row, row_number)
+        for row, key, row_number in zip(rows, keys, row_numbers)
+    ]
+
+def process_rows_with_transformers(rows, system_prompt, create_prompt, response_cache):
+    model, tokenizer, device = load_phi3_model()
+    
+    # Greedy decoding: the cleaned row is a ~250 token JSON object, and a fixed
+    # input always gives the same output
+    generation_args = {
+        "max_new_tokens": 512,
+        "do_sample": False,
+        "num_return_sequences": 1,
+        "stop_strings": ["}"]  # The row object has no nested braces, so stop at its end
+    }
+    # Quantization differs per device, so the device is part of the backend
+    namespace = cache_namespace(f"transformers-{device.type}", sorted(generation_args.items()))
+    
+    # Reuse the system message KV cache across batches; the static cache on CUDA
+    # is allocated by generate itself, so there every batch prefills in full
+    prefix = None
+    if device.type != "cuda":
+        prefix = {"ids": shared_prefix_ids(tokenizer, system_prompt), "cache": None}
+    
+    # Prompts for the next window are built on a worker thread while the model generates
+    # the current one; the worker only renders text, so the tokenizer is never shared
+    with ThreadPoolExecutor(max_workers=1) as prompt_builder:
+        next_prompts = prompt_builder.submit(build_prompts, rows[:SORT_WINDOW], tokenizer, system_prompt, create_prompt)
+        batch_count = 0
+        
+        for start in tqdm(range(0, len(rows), SORT_WINDOW)):
+            window = rows[start:start + SORT_WINDOW]
+            prompts = next_prompts.result()
+            next_prompts = prompt_builder.submit(
+                build_prompts,
+                rows[start + SORT_WINDOW:start + 2 * SORT_WINDOW],
+                tokenizer,
+                system_prompt,
+                create_prompt
+            )
+            
+            # Batch prompts of similar length together so little of each batch is padding,
+            # then put the results back in row order
+            order = sorted(range(len(window)), key=lambda i: len(prompts[i]))
+            results = [None] * len(window)
+            
+            for batch_start in range(0, len(order), BATCH_SIZE):
+                batch_order = order[batch_start:batch_start + BATCH_SIZE]
+                batch_results = process_batch(
+                    [window[i] for i in batch_order],
+                    [prompts[i] for i in batch_order],
+                    [start + i + 1 for i in batch_order],
+                    model, tokenizer, device, generation_args, response_cache, namespace, prefix
+                )
+                for i, result in zip(batch_order, batch_results):
+                    results[i] = result
+                
+                # Memory management; emptying the cache stalls the device, so only do it occasionally
+                batch_count += 1
+                if batch_count % EMPTY_CACHE_EVERY == 0:
+                    if device.type == "mps":
+                        torch.mps.empty_cache()
+                    elif device.type == "cuda":
+                        torch.cuda.empty_cache()
+            
+            yield results
+
+def process_rows_with_vllm(rows, system_prompt, create_prompt, response_cache):
+    llm = LLM(
+        model=MODEL_NAME,
+        dtype="float16",
+        max_model_len=2048,
+        gpu_memory_utilization=0.9,
+        enable_prefix_caching=True  # Rows share the system message KV blocks
+    )
+    tokenizer = llm.get_tokenizer()
+    
+    prompts = build_prompts(rows, tokenizer, system_prompt, create_prompt)
+    
+    # Submit every uncached prompt at once; continuous batching keeps the GPU busy until all rows finish
+    sampling_args = {
+        "temperature": 0,  # Greedy decoding
+        "max_tokens": 512,
+        "stop": ["}"],
+        "include_stop_str_in_output": True
+    }
+    # Releases without GuidedDecodingParams have no guided_decoding field either
+    if GuidedDecodingParams is not None:
+        sampling_args["guided_decoding"] = GuidedDecodingParams(json=CLEANED_ROW_SCHEMA)
+    sampling_params = SamplingParams(**sampling_args)
+    # SamplingParams' repr varies across vLLM versions, so key on the settings that shape the output
+    namespace = cache_namespace(
+        "vllm",
+        sorted({**sampling_args, "guided_decoding": "guided_decoding" in sampling_args}.items())
+    )
+    keys = [prompt_key(prompt, namespace) for prompt in prompts]
+    pending = [i for i, key in enumerate(keys) if key not in response_cache]
+    if pending:
+        outputs = llm.generate([prompts[i] for i in pending], sampling_params)
+        
+        # Outputs come back in prompt order
+        for i, output in zip(pending, outputs):
+            response_cache[keys[i]] = output.outputs[0].text
+    
+    yield [
+        process_single_response(response_cache[key], row, row_number)
+        for row_number, (row, key) in enumerate(zip(rows, keys), start=1)
+    ]
+
+def clean_csv_with_phi3(csv_path, system_prompt, create_prompt, output_file, max_rows=None):
+    try:
+        # Read data efficiently; timestamps stay as written so the model sees the raw values
+        df = pd.read_csv(csv_path, engine="pyarrow", dtype={'started_at': str, 'ended_at': str})
+        if max_rows:
+            df = df.head(max_rows)
+        
+        # Process rows
+        corrected_rows = []
+        rows = df.to_dict('records')
+        
+        # Stream each cleaned row to disk as one JSON line
+        with shelve.open(RESPONSE_CACHE_PATH) as response_cache, open(output_file, 'wb', buffering=1 << 20) as out_f:
+            if LLM is not None and torch.cuda.is_available():
+                batches = process_rows_with_vllm(rows, system_prompt, create_prompt, response_cache)
+            else:
+                batches = process_rows_with_transformers(rows, system_prompt, create_prompt, response_cache)
+            
+            for results in batches:
+                corrected_rows.extend(results)
+                
+                for result in results:
+                    out_f.write(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE))
+                
+                # Checkpoint the buffered rows whenever another FSYNC_EVERY rows are done
+                if len(corrected_rows) // FSYNC_EVERY > (len(corrected_rows) - len(results)) // FSYNC_EVERY:
+                    out_f.flush()
+                    os.fsync(out_f.fileno())
+        
+        print(f"\nCleaning complete! Processed {len(corrected_rows)} rows")
+        print(f"Results saved to {output_file}")
+        
+        return corrected_rows
+        
+    except Exception as e:
+        print(f"Error in cleaning process: {str(e)}")
+        return None